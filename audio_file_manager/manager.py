@@ -1,13 +1,14 @@
+import errno
 import json
+import os
 import time
 import logging
 import wave
 import shutil
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 import platform
-import tempfile
-from threading import Event
+from threading import Event, Lock, Timer
 from typing import Any, Dict, Optional, Union
 
 try:
@@ -18,11 +19,143 @@ try:
         import sounddevice as sd
         import numpy as np
         AUDIO_BACKEND = "sounddevice"
-except ImportError:
+except (ImportError, OSError):
+    # sounddevice raises OSError rather than ImportError when the PortAudio library is missing.
     AUDIO_BACKEND = None
 
+if platform.system() == "Linux":
+    import fcntl
+else:
+    fcntl = None
+
+try:
+    # Optional: a faster drop-in for reading and writing the metadata file.
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+# Target duration of one ALSA capture period. The blocking read() returns once per period,
+# so this bounds both the wakeup rate of the recording thread and how long it takes to
+# notice stop_event.
+ALSA_PERIOD_MS = 20
+
+# Capacity in frames of the ring shared with the sounddevice callback (~1.5 s at 44.1 kHz).
+# Must be a power of two.
+SD_RING_FRAMES = 1 << 16
+
+# How often the recording thread drains the ring. Each wakeup copies out everything that
+# accumulated since the last one, so this only needs to be well under the ring's capacity.
+SD_DRAIN_INTERVAL = 0.05
+
+# Number of frames read from the WAV file and written to the output stream at a time.
+PLAYBACK_BLOCK_FRAMES = 4096
+
+# Write buffer size in bytes for WAV files being recorded (~12 s of mono 44.1 kHz audio).
+WAV_WRITE_BUFFER = 1 << 20
+
+# Delay in seconds before pending metadata changes are written. Saves requested within this
+# window are coalesced into a single write.
+METADATA_SAVE_DELAY = 0.25
+
+# ioctl request asking the filesystem to make the destination share the source's data blocks
+# copy-on-write (btrfs, XFS, bcachefs, ...).
+_FICLONE = 0x40049409
+
+
+def _fast_copy(src: Union[str, Path], dst: Union[str, Path]) -> None:
+    """
+    Copies the contents of src to dst. On Linux the data never passes through user space: it is a
+    copy-on-write clone when the filesystem supports it and an in-kernel copy_file_range() otherwise.
+    Like shutil.copyfile, raises shutil.SameFileError if src and dst are the same file.
+    """
+    # Opening dst for writing below truncates it, which would destroy src if they are the same file.
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        raise shutil.SameFileError(f"{src!r} and {dst!r} are the same file")
+    if fcntl is not None:
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                try:
+                    fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+                    return
+                except OSError:
+                    pass
+                if hasattr(os, 'copy_file_range'):
+                    remaining = os.fstat(fsrc.fileno()).st_size
+                    while remaining > 0:
+                        copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                        if not copied:
+                            # Some filesystems (FUSE, overlayfs) report 0 before the end of the file.
+                            break
+                        remaining -= copied
+                    if remaining == 0:
+                        return
+        except OSError:
+            # Not supported by this kernel or filesystem pair; fall through to a regular copy.
+            pass
+    shutil.copyfile(src, dst)
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _utc_now():
+    """Reads the clock once and returns (epoch seconds, naive UTC ISO timestamp) for that instant."""
+    seconds, nanos = divmod(time.time_ns(), 1_000_000_000)
+    return seconds, (_EPOCH + timedelta(seconds=seconds, microseconds=nanos // 1000)).isoformat()
+
+
+def _duration_seconds(nframes: int, rate: int) -> float:
+    """Whole milliseconds of audio, in seconds: integer math, so the same frame count always stores the same value."""
+    return (nframes * 1000 // rate) / 1000
+
+
+class _PcmRing:
+    """
+    Single-producer/single-consumer ring buffer of int16 frames.
+
+    The sounddevice callback is the only writer and the recording thread the only reader.
+    Each side only ever advances its own index, and int attribute stores are atomic under
+    the GIL, so neither side needs a lock and the callback never allocates sample buffers.
+    """
+
+    def __init__(self, capacity: int, channels: int):
+        # Indices wrap with `& self._mask`, which only works for power-of-two capacities.
+        if capacity <= 0 or capacity & (capacity - 1):
+            raise ValueError(f"Ring capacity must be a power of two, got {capacity}.")
+        self._buf = np.empty((capacity, channels), dtype=np.int16)
+        self._mask = capacity - 1
+        self._write_idx = 0
+        self._read_idx = 0
+        self.overflows = 0
+
+    def write(self, data) -> None:
+        n = len(data)
+        capacity = len(self._buf)
+        if n > capacity - (self._write_idx - self._read_idx):
+            # The reader fell behind; drop the block rather than overwrite unread frames.
+            self.overflows += 1
+            return
+        start = self._write_idx & self._mask
+        first = min(n, capacity - start)
+        self._buf[start:start + first] = data[:first]
+        self._buf[:n - first] = data[first:]
+        self._write_idx += n
+
+    def read(self, sink) -> int:
+        """Passes all pending frames to sink as at most two contiguous views and returns the frame count."""
+        end = self._write_idx
+        n = end - self._read_idx
+        if n:
+            start = self._read_idx & self._mask
+            first = min(n, len(self._buf) - start)
+            sink(self._buf[start:start + first])
+            if n > first:
+                sink(self._buf[:n - first])
+            self._read_idx = end
+        return n
+
 
 class AudioFileManager:
     def __init__(self, storage_dir: Optional[Union[str, Path]] = None, metadata_file: Optional[Union[str, Path]] = None, num_buttons: int = 16):
@@ -34,27 +167,73 @@ class AudioFileManager:
 
         self.storage_dir = Path(storage_dir)
         self.metadata_file = Path(metadata_file) if metadata_file else self.storage_dir.parent / "metadata.json"
-        self._temp_dir_obj = tempfile.TemporaryDirectory(prefix="audio_staging_")
-        self.temp_dir = Path(self._temp_dir_obj.name)
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        # Staging inside storage_dir keeps temp files on the same filesystem as their final location,
+        # so finalize_recording can move them with a single rename instead of copying the data. The
+        # name is fixed, so anything a crashed process left behind is cleared on the next start.
+        self.temp_dir = self.storage_dir / ".audio_staging"
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        self.temp_dir.mkdir()
         self.num_buttons = num_buttons
 
-        self.storage_dir.mkdir(parents=True, exist_ok=True)
         self.metadata: Dict[str, Dict[str, Any]] = self._load_metadata()
-        logger.info(f"AudioFileManager initialized. Storage: {self.storage_dir}")
+        self._save_lock = Lock()
+        self._save_timer: Optional[Timer] = None
+        # True while self.metadata holds changes that have not been written successfully.
+        self._save_pending = False
+        logger.info("AudioFileManager initialized. Storage: %s", self.storage_dir)
 
     def _load_metadata(self) -> Dict[str, Dict[str, Any]]:
         if self.metadata_file.exists():
-            logger.debug(f"Loading metadata from {self.metadata_file}")
-            with open(self.metadata_file, 'r') as f:
-                return json.load(f)
+            logger.debug("Loading metadata from %s", self.metadata_file)
+            data = self.metadata_file.read_bytes()
+            return orjson.loads(data) if orjson is not None else json.loads(data)
         return {}
 
     def _save_metadata(self):
-        with open(self.metadata_file, 'w') as f:
-            logger.debug(f"Saving metadata to {self.metadata_file}")
-            json.dump(self.metadata, f, indent=4)
-
-    def record_audio_to_temp(self, button_id: Union[str, int], message_type: str, stop_event: Event, channels: int = 1, rate: int = 44100) -> Dict[str, Any]:
+        """Schedules a metadata write; saves requested before it runs are folded into the same write."""
+        with self._save_lock:
+            self._save_pending = True
+            if self._save_timer is None:
+                self._save_timer = Timer(METADATA_SAVE_DELAY, self._flush_metadata_on_timer)
+                self._save_timer.start()
+
+    def _flush_metadata_on_timer(self):
+        try:
+            self.flush_metadata()
+        except Exception:
+            # Nobody is waiting on the timer thread. The changes stay pending, so the next save,
+            # flush_metadata() or cleanup() retries the write and raises to its caller if it fails again.
+            logger.exception("Failed to save metadata to %s", self.metadata_file)
+
+    def flush_metadata(self) -> None:
+        """Writes any pending metadata changes to disk immediately. If the write fails they stay pending."""
+        with self._save_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if not self._save_pending:
+                return
+            self._write_metadata()
+            self._save_pending = False
+
+    def _write_metadata(self):
+        logger.debug("Saving metadata to %s", self.metadata_file)
+        # Runs on the timer thread, so serialize a snapshot rather than the live dicts.
+        snapshot = {button_id: dict(info) for button_id, info in dict(self.metadata).items()}
+        if orjson is not None:
+            data = orjson.dumps(snapshot)
+        else:
+            data = json.dumps(snapshot, separators=(',', ':')).encode()
+        # Write a sibling file and rename it over the original so a crash never leaves a truncated file.
+        tmp_file = self.metadata_file.with_name(self.metadata_file.name + ".tmp")
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.metadata_file)
+
+    def record_audio_to_temp(self, button_id: Union[str, int], message_type: str, stop_event: Event, channels: int = 1, rate: int = 44100, period_size: Optional[int] = None, periods: Optional[int] = None) -> Dict[str, Any]:
         """
             Records audio from the system microphone to a temporary WAV file until the provided stop_event is triggered.
 
@@ -62,14 +241,21 @@ class AudioFileManager:
             - On Linux: Uses ALSA via pyalsaaudio
             - On Windows/macOS: Uses sounddevice
 
-            Audio data is streamed in real time, accumulated in memory, and written to a WAV file once stopped.
-            The duration is calculated based on the recorded byte length.
+            Audio data is streamed in real time and written to the WAV file as it is captured.
+            The duration is calculated from the number of frames written.
 
         :param button_id: (str or int) ID representing the logical button associated with this recording.
         :param message_type: Semantic label or category for the audio (away, custom, etc.)
         :param stop_event: A live threading event object. When set, recording stops.
         :param channels: Number of channels to record. Default is 1 (mono).
         :param rate: Sample rate in Hz. Default is 44100.
+        :param period_size: Frames delivered per read (ALSA period / sounddevice block). Smaller values lower
+            capture latency at the cost of more wakeups. Default is None, which uses ALSA_PERIOD_MS worth of
+            frames on ALSA and lets PortAudio pick the block size on sounddevice, where it may not
+            exceed SD_RING_FRAMES.
+        :param periods: Number of periods in the ALSA capture buffer (ALSA only, needs pyalsaaudio >= 0.9).
+            More periods give the recording thread more slack before an overrun. Default is None, which
+            keeps the pyalsaaudio default.
         :return: dict: A metadata dictionary with the following keys:
             - 'button_id': Button ID used
             - 'message_type': Provided label for the message
@@ -79,68 +265,72 @@ class AudioFileManager:
         """
         button_id = str(button_id)
         keyword = message_type.lower().replace(" ", "_")
-        filename = f"{button_id}_{keyword}_{int(time.time())}.wav"
+        seconds, timestamp = _utc_now()
+        filename = f"{button_id}_{keyword}_{seconds}.wav"
         temp_path = self.temp_dir / filename
-        timestamp = datetime.utcnow().isoformat()
-        pcm_bytes = b''
         # For S16_LE format, each sample is 2 bytes
         sample_width_bytes = 2
 
-        if AUDIO_BACKEND == "alsaaudio":
-            inp = alsaaudio.PCM(alsaaudio.PCM_CAPTURE, alsaaudio.PCM_NORMAL)
-            inp.setchannels(channels)
-            inp.setrate(rate)
-            inp.setformat(alsaaudio.PCM_FORMAT_S16_LE)
-            inp.setperiodsize(1024)
-
-            frames = []
-            while not stop_event.is_set():
-                length, data = inp.read()
-                if length:
-                    frames.append(data)
-            pcm_bytes = b''.join(frames)
-
-        elif AUDIO_BACKEND == "sounddevice":
-            import queue
-
-            q = queue.Queue()
-
-            def callback(indata, frames, time, status):
-                if stop_event.is_set():
-                    raise sd.CallbackStop()
-                q.put(indata.copy())
-
-            audio_chunks = []
+        if AUDIO_BACKEND not in ("alsaaudio", "sounddevice"):
+            raise NotImplementedError("No supported audio backend available on this platform.")
+        if AUDIO_BACKEND == "sounddevice" and period_size is not None and period_size > SD_RING_FRAMES:
+            # A block larger than the ring could never be stored, leaving an empty recording.
+            raise ValueError(f"period_size must not exceed {SD_RING_FRAMES} frames on sounddevice, got {period_size}.")
+
+        # Captured frames go to the WAV file as they arrive, so memory use stays at about one period
+        # however long the recording runs. The large file buffer turns the per-period writes into a
+        # few big ones, and wave patches the header sizes once when the file is closed.
+        with open(temp_path, 'wb', buffering=WAV_WRITE_BUFFER) as f, wave.open(f, 'wb') as wf:
+            wf.setnchannels(channels)
+            wf.setsampwidth(sample_width_bytes)
+            wf.setframerate(rate)
 
-            with sd.InputStream(callback=callback, channels=channels, samplerate=rate, dtype='int16'):
+            if AUDIO_BACKEND == "alsaaudio":
+                if period_size is None:
+                    period_size = max(rate * ALSA_PERIOD_MS // 1000, 1)
+                # Only passed when requested, so older pyalsaaudio releases without the keyword keep working.
+                pcm_kwargs = {} if periods is None else {"periods": periods}
+                inp = alsaaudio.PCM(alsaaudio.PCM_CAPTURE, alsaaudio.PCM_NORMAL, **pcm_kwargs)
+                inp.setchannels(channels)
+                inp.setrate(rate)
+                inp.setformat(alsaaudio.PCM_FORMAT_S16_LE)
+                inp.setperiodsize(period_size)
+
+                overruns = 0
                 while not stop_event.is_set():
-                    try:
-                        data = q.get(timeout=0.1)
-                        audio_chunks.append(data)
-                    except queue.Empty:
-                        continue
-
-            if audio_chunks:
-                all_audio = np.concatenate(audio_chunks)
-                pcm_bytes = all_audio.tobytes()
+                    # Blocks (with the GIL released) until a full period is available.
+                    # A negative length signals an overrun that ALSA has already recovered from.
+                    length, data = inp.read()
+                    if length > 0:
+                        wf.writeframesraw(data)
+                    elif length < 0:
+                        overruns += 1
+                if overruns:
+                    logger.warning("ALSA capture overran %s time(s): recording thread could not keep up.", overruns)
+
             else:
-                # If no audio was captured, pcm_bytes remains empty
-                pcm_bytes = b''
+                ring = _PcmRing(SD_RING_FRAMES, channels)
 
-        else:
-            raise NotImplementedError("No supported audio backend available on this platform.")
+                def callback(indata, frames, time, status):
+                    if stop_event.is_set():
+                        raise sd.CallbackStop()
+                    ring.write(indata)
 
-        duration = len(pcm_bytes) / (rate * channels * sample_width_bytes)
-        with wave.open(str(temp_path), 'wb') as wf:
-            wf.setnchannels(channels)
-            wf.setsampwidth(2)
-            wf.setframerate(rate)
-            wf.writeframes(pcm_bytes)
+                with sd.InputStream(callback=callback, channels=channels, samplerate=rate, dtype='int16', blocksize=period_size or 0):
+                    # wait() returns as soon as stop_event is set, so stopping does not wait out the interval.
+                    while not stop_event.wait(SD_DRAIN_INTERVAL):
+                        ring.read(wf.writeframesraw)
+                # Pick up whatever the callback wrote after the last poll.
+                ring.read(wf.writeframesraw)
+                if ring.overflows:
+                    logger.warning("Dropped %s audio block(s): recording thread could not keep up.", ring.overflows)
+
+            duration = _duration_seconds(wf.getnframes(), rate)
 
         return {
             "button_id": button_id,
             "message_type": message_type,
-            "duration": round(duration, 2),
+            "duration": duration,
             "temp_path": str(temp_path),
             "timestamp": timestamp
         }
@@ -158,61 +348,81 @@ class AudioFileManager:
             logger.warning("Playback is only supported with the 'sounddevice' backend.")
             raise NotImplementedError("Playback not supported on this audio backend.")
 
-        import sounddevice as sd
-        import numpy as np
-
         path = Path(file_path)
         if not path.exists():
-            logger.error(f"Cannot play audio: file not found at {path}")
+            logger.error("Cannot play audio: file not found at %s", path)
             return
 
         try:
             with wave.open(str(path), 'rb') as wf:
                 samplerate = wf.getframerate()
                 n_channels = wf.getnchannels()
-                sampwidth = wf.getsampwidth()
-                n_frames = wf.getnframes()
-                audio_bytes = wf.readframes(n_frames)
 
-            # The recorder uses 16-bit audio, so we expect that for playback.
-            audio_array = np.frombuffer(audio_bytes, dtype=np.int16)
-
-            logger.info(f"Playing audio from {path}...")
-            sd.play(audio_array, samplerate=samplerate, blocking=True)
+                logger.info("Playing audio from %s...", path)
+                # The recorder uses 16-bit audio, so we expect that for playback. Frames are
+                # streamed one block at a time, so memory use does not grow with the file and
+                # playback starts without reading the whole file first. Leaving the stream
+                # context waits for the queued audio to finish playing.
+                with sd.RawOutputStream(samplerate=samplerate, channels=n_channels, dtype='int16') as stream:
+                    data = wf.readframes(PLAYBACK_BLOCK_FRAMES)
+                    while data:
+                        stream.write(data)
+                        data = wf.readframes(PLAYBACK_BLOCK_FRAMES)
             logger.info("Playback finished.")
         except Exception as e:
-            logger.error(f"Failed to play audio file {path}: {e}")
+            logger.error("Failed to play audio file %s: %s", path, e)
 
     def finalize_recording(self, temp_path_info: Dict[str, Any]) -> None:
         button_id = str(temp_path_info["button_id"])
         if self.metadata.get(button_id, {}).get('read_only'):
-            logger.warning(f"Finalizing recording blocked: Button {button_id} is read-only.")
+            logger.warning("Finalizing recording blocked: Button %s is read-only.", button_id)
             return
 
-        final_path = self.storage_dir / Path(temp_path_info["temp_path"]).name
-        shutil.move(temp_path_info["temp_path"], final_path)
-        logger.info(f"Finalized recording for button '{button_id}' to {final_path}")
-
+        temp_path = temp_path_info["temp_path"]
+        final_path = self.storage_dir / Path(temp_path).name
+        try:
+            os.replace(temp_path, final_path)
+        except OSError as e:
+            # A rename cannot cross filesystems, which happens when the temp file was not staged by us.
+            # Any other failure (missing file, permissions, ...) is a real error.
+            if e.errno != errno.EXDEV:
+                raise
+            _fast_copy(temp_path, final_path)
+            os.unlink(temp_path)
+        logger.info("Finalized recording for button '%s' to %s", button_id, final_path)
+
+        self._store_recording(button_id, final_path, temp_path_info["duration"], temp_path_info["timestamp"],
+                              temp_path_info["message_type"])
+
+    def _store_recording(self, button_id: str, path: Path, duration: Optional[float], timestamp: str,
+                         message_type: str, is_default: bool = False) -> None:
+        """Records path as the WAV file for button_id and saves the metadata. Defaults are always read-only."""
         self.metadata[button_id] = {
-            "name": final_path.name,
-            "duration": temp_path_info["duration"],
-            "path": str(final_path),
-            "timestamp": temp_path_info["timestamp"],
-            "message_type": temp_path_info["message_type"],
+            "name": path.name,
+            "duration": duration,
+            "path": str(path),
+            "timestamp": timestamp,
+            "message_type": message_type,
             "audio_format": "wav",
-            "read_only": False,
-            "is_default": False
+            "read_only": is_default,
+            "is_default": is_default
         }
         self._save_metadata()
 
     def cleanup(self) -> None:
-        """Removes the temporary directory and all its contents."""
-        self._temp_dir_obj.cleanup()
+        """Writes pending metadata changes and removes the temporary directory and all its contents."""
+        try:
+            self.flush_metadata()
+        finally:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
 
     def discard_recording(self, button_id: Union[str, int]) -> None:
-        button_id = str(button_id)
-        for f in self.temp_dir.glob(f"{button_id}_*.wav"):
-            f.unlink()
+        prefix = f"{button_id}_"
+        # One directory pass with plain string checks; no glob pattern compilation or Path objects.
+        with os.scandir(self.temp_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith(prefix) and entry.name.endswith(".wav"):
+                    os.unlink(entry.path)
 
     def set_read_only(self, button_id: Union[str, int], read_only: bool = True) -> None:
         button_id = str(button_id)
@@ -230,58 +440,38 @@ class AudioFileManager:
     def assign_default(self, button_id: Union[str, int], file_path: Union[str, Path]) -> None:
         button_id = str(button_id)
         if not Path(file_path).exists():
-            logger.error(f"Cannot assign default: source file not found at {file_path}")
+            logger.error("Cannot assign default: source file not found at %s", file_path)
             return
 
-        default_name = f"default_{button_id}.wav"
-        default_path = self.storage_dir / default_name
-        shutil.copy(file_path, default_path)
+        default_path = self.storage_dir / f"default_{button_id}.wav"
+        _fast_copy(file_path, default_path)
 
         duration = None
         try:
             with wave.open(str(default_path), 'rb') as wf:
-                duration = round(wf.getnframes() / float(wf.getframerate()), 2)
+                duration = _duration_seconds(wf.getnframes(), wf.getframerate())
         except wave.Error:
-            logger.warning(f"Could not read duration from {default_path}. Duration set to None.")
+            logger.warning("Could not read duration from %s. Duration set to None.", default_path)
 
-        self.metadata[button_id] = {
-            "name": default_name,
-            "duration": duration,
-            "path": str(default_path),
-            "timestamp": datetime.utcnow().isoformat(),
-            "message_type": "default",
-            "audio_format": "wav",
-            "read_only": True,
-            "is_default": True
-        }
-        self._save_metadata()
+        self._store_recording(button_id, default_path, duration, _utc_now()[1], "default",
+                              is_default=True)
 
     def restore_default(self, button_id: Union[str, int]) -> None:
         button_id = str(button_id)
         default_path = self.storage_dir / f"default_{button_id}.wav"
         if not default_path.exists():
-            logger.warning(f"Cannot restore default for '{button_id}': default file not found.")
+            logger.warning("Cannot restore default for '%s': default file not found.", button_id)
             return
 
-        restored_path = self.storage_dir / f"{button_id}_restored_{int(time.time())}.wav"
-        shutil.copy(default_path, restored_path)
+        seconds, timestamp = _utc_now()
+        restored_path = self.storage_dir / f"{button_id}_restored_{seconds}.wav"
+        _fast_copy(default_path, restored_path)
 
         duration = None
         try:
             with wave.open(str(restored_path), 'rb') as wf:
-                duration = round(wf.getnframes() / float(wf.getframerate()), 2)
+                duration = _duration_seconds(wf.getnframes(), wf.getframerate())
         except wave.Error:
-            logger.warning(f"Could not read duration from restored file {restored_path}. Duration set to None.")
-
+            logger.warning("Could not read duration from restored file %s. Duration set to None.", restored_path)
 
-        self.metadata[button_id] = {
-            "name": restored_path.name,
-            "duration": duration,
-            "path": str(restored_path),
-            "timestamp": datetime.utcnow().isoformat(),
-            "message_type": "restored_default",
-            "audio_format": "wav",
-            "read_only": False,
-            "is_default": False
-        }
-        self._save_metadata()
+        self._store_recording(button_id, restored_path, duration, timestamp, "restored_default")
@@ -2,10 +2,16 @@ import unittest
 import tempfile
 import shutil
 import os
+import errno
+import json
+import wave
+from unittest import mock
 from pathlib import Path
 import logging
 from datetime import datetime
 from audio_file_manager import AudioFileManager
+from audio_file_manager import manager as manager_module
+from audio_file_manager.manager import _fast_copy
 
 DUMMY_AUDIO = b'\x00\x01' * 8000
 
@@ -34,6 +40,25 @@ class TestAudioFileManagerMetadataOnly(unittest.TestCase):
         self.assertEqual(Path(meta['path']), expected_path)
         self.assertTrue(expected_path.exists())
 
+    def test_assign_default_stores_whole_millisecond_duration(self):
+        source_path = Path(self.test_dir) / "timed.wav"
+        with wave.open(str(source_path), 'wb') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(44100)
+            wf.writeframes(b'\x00\x00' * 12345)
+        self.manager.assign_default('btn11', source_path)
+        self.assertEqual(self.manager.metadata['btn11']['duration'], 0.279)
+
+    def test_assign_default_twice_from_read_only_source(self):
+        source_path = Path(self.test_dir) / "readonly_default.wav"
+        source_path.write_bytes(DUMMY_AUDIO)
+        source_path.chmod(0o444)
+        self.manager.assign_default('btn15', source_path)
+        self.manager.assign_default('btn15', source_path)
+        default_path = Path(self.manager.metadata['btn15']['path'])
+        self.assertEqual(default_path.read_bytes(), DUMMY_AUDIO)
+
     def test_restore_default_creates_new_file(self):
         default_path = Path(self.test_dir) / "default.wav"
         default_path.write_bytes(DUMMY_AUDIO)
@@ -50,6 +75,59 @@ class TestAudioFileManagerMetadataOnly(unittest.TestCase):
         self.assertIsNone(restored_meta['duration'], "Duration should be None for restored files by default.")
         self.assertTrue(restored_path.exists())
 
+    def test_restore_default_name_and_timestamp_share_one_clock_reading(self):
+        source_path = Path(self.test_dir) / "clock_default.wav"
+        source_path.write_bytes(DUMMY_AUDIO)
+        self.manager.assign_default('btn21', source_path)
+        self.manager.restore_default('btn21')
+        meta = self.manager.metadata['btn21']
+        seconds = int(meta['name'].rsplit('_', 1)[1][:-len('.wav')])
+        stamp = datetime.fromisoformat(meta['timestamp'])
+        self.assertIsNone(stamp.tzinfo)
+        self.assertEqual(int((stamp - datetime(1970, 1, 1)).total_seconds()), seconds)
+
+    def test_finalize_recording_moves_staged_file(self):
+        temp = self.manager.temp_dir / "btn25_note_0.wav"
+        temp.write_bytes(DUMMY_AUDIO)
+        self.manager.finalize_recording({
+            "button_id": 'btn25',
+            "message_type": "note",
+            "duration": 0.18,
+            "temp_path": str(temp),
+            "timestamp": datetime.utcnow().isoformat()
+        })
+        final_path = self.manager.storage_dir / temp.name
+        self.assertFalse(temp.exists())
+        self.assertEqual(final_path.read_bytes(), DUMMY_AUDIO)
+        self.assertEqual(self.manager.metadata['btn25']['path'], str(final_path))
+
+    def _staged_info(self, button_id):
+        temp_path = self.manager.temp_dir / f"{button_id}_note_1.wav"
+        temp_path.write_bytes(DUMMY_AUDIO)
+        return {
+            "button_id": button_id,
+            "message_type": "note",
+            "duration": 1.0,
+            "temp_path": str(temp_path),
+            "timestamp": datetime.utcnow().isoformat()
+        }
+
+    def test_finalize_recording_copies_across_filesystems(self):
+        info = self._staged_info('btn31')
+        with mock.patch.object(os, 'replace', side_effect=OSError(errno.EXDEV, "Invalid cross-device link")):
+            self.manager.finalize_recording(info)
+        final_path = Path(self.manager.metadata['btn31']['path'])
+        self.assertEqual(final_path.read_bytes(), DUMMY_AUDIO)
+        self.assertFalse(os.path.exists(info['temp_path']))
+
+    def test_finalize_recording_does_not_copy_on_other_errors(self):
+        info = self._staged_info('btn32')
+        with mock.patch.object(os, 'replace', side_effect=PermissionError(errno.EACCES, "Permission denied")):
+            with self.assertRaises(PermissionError):
+                self.manager.finalize_recording(info)
+        self.assertTrue(os.path.exists(info['temp_path']))
+        self.assertNotIn('btn32', self.manager.metadata)
+
     def test_set_read_only_flag(self):
         button_id = 'btn30'
         self.manager.metadata[button_id] = {"read_only": False}
@@ -83,6 +161,24 @@ class TestAudioFileManagerMetadataOnly(unittest.TestCase):
         self.assertTrue(final_path.exists())
         self.assertFalse(temp.exists())
 
+    def test_startup_clears_files_left_in_staging(self):
+        leftover = self.manager.temp_dir / "btn40_note_1.wav"
+        leftover.write_bytes(DUMMY_AUDIO)
+        # Simulate a process that died without calling cleanup().
+        self.manager = AudioFileManager(storage_dir=self.test_dir, metadata_file=self.meta_file)
+        self.assertEqual(self.manager.temp_dir, Path(self.test_dir) / ".audio_staging")
+        self.assertTrue(self.manager.temp_dir.is_dir())
+        self.assertFalse(leftover.exists())
+
+    def test_discard_recording_matches_button_prefix_only(self):
+        own = self.manager.temp_dir / "btn5_note_1.wav"
+        other = self.manager.temp_dir / "btn55_note_1.wav"
+        own.write_bytes(b"temp")
+        other.write_bytes(b"temp")
+        self.manager.discard_recording('btn5')
+        self.assertFalse(own.exists())
+        self.assertTrue(other.exists())
+
     def test_assign_default_with_missing_source_logs_error(self):
         button_id = 'btn60'
         missing_path = Path(self.test_dir) / "non_existent.wav"
@@ -108,3 +204,81 @@ class TestAudioFileManagerMetadataOnly(unittest.TestCase):
         # This should execute without error and without changing metadata
         self.manager.set_read_only(button_id, True)
         self.assertNotIn(button_id, self.manager.metadata)
+
+    def test_save_metadata_replaces_file_without_leftovers(self):
+        self.manager.metadata['btn90'] = {"message_type": "saved"}
+        self.manager._save_metadata()
+        self.manager.flush_metadata()
+        with open(self.meta_file) as f:
+            self.assertEqual(json.load(f), self.manager.metadata)
+        self.assertFalse(os.path.exists(self.meta_file + '.tmp'))
+
+    def test_indented_metadata_file_still_loads(self):
+        with open(self.meta_file, 'w') as f:
+            json.dump({"btn95": {"message_type": "legacy"}}, f, indent=4)
+        manager = AudioFileManager(storage_dir=Path(self.test_dir) / "other", metadata_file=self.meta_file)
+        try:
+            self.assertEqual(manager.metadata["btn95"]["message_type"], "legacy")
+        finally:
+            manager.cleanup()
+
+    @mock.patch.object(manager_module, 'METADATA_SAVE_DELAY', 3600)
+    def test_metadata_saves_are_coalesced_until_flushed(self):
+        self.manager.metadata['btn100'] = {"read_only": False}
+        self.manager.set_read_only('btn100', True)
+        pending = self.manager._save_timer
+        self.assertIsNotNone(pending)
+        self.manager.set_read_only('btn100', False)
+        self.assertIs(self.manager._save_timer, pending)
+
+        self.manager.flush_metadata()
+        self.assertIsNone(self.manager._save_timer)
+        with open(self.meta_file) as f:
+            self.assertFalse(json.load(f)['btn100']['read_only'])
+
+    def test_assign_default_from_its_own_default_file_keeps_it_intact(self):
+        source_path = Path(self.test_dir) / "self_default.wav"
+        source_path.write_bytes(DUMMY_AUDIO)
+        self.manager.assign_default('btn12', source_path)
+        default_path = self.manager.metadata['btn12']['path']
+        with self.assertRaises(shutil.SameFileError):
+            self.manager.assign_default('btn12', default_path)
+        self.assertEqual(Path(default_path).read_bytes(), DUMMY_AUDIO)
+
+    def test_failed_background_save_is_logged_and_kept_pending(self):
+        meta_dir = Path(self.test_dir) / "not_yet_created"
+        manager = AudioFileManager(storage_dir=Path(self.test_dir) / "other", metadata_file=meta_dir / "meta.json")
+        manager.metadata['btn110'] = {"message_type": "pending"}
+        manager._save_metadata()
+        manager._save_timer.cancel()
+        with self.assertLogs('audio_file_manager.manager', level='ERROR') as cm:
+            manager._flush_metadata_on_timer()
+        self.assertIn("Failed to save metadata", cm.output[0])
+
+        with self.assertRaises(OSError):
+            manager.flush_metadata()
+
+        meta_dir.mkdir()
+        manager.cleanup()
+        with open(meta_dir / "meta.json") as f:
+            self.assertEqual(json.load(f)['btn110']['message_type'], "pending")
+
+    def test_fast_copy_duplicates_contents(self):
+        src = Path(self.test_dir) / "src.wav"
+        dst = Path(self.test_dir) / "dst.wav"
+        src.write_bytes(DUMMY_AUDIO)
+        dst.write_bytes(b"stale contents that are longer than nothing")
+        _fast_copy(src, dst)
+        self.assertEqual(dst.read_bytes(), DUMMY_AUDIO)
+        self.assertEqual(src.read_bytes(), DUMMY_AUDIO)
+
+    @unittest.skipUnless(manager_module.fcntl is not None and hasattr(os, 'copy_file_range'),
+                         "copy_file_range path is Linux-only.")
+    def test_fast_copy_falls_back_when_copy_file_range_stops_early(self):
+        src = Path(self.test_dir) / "src.wav"
+        dst = Path(self.test_dir) / "dst.wav"
+        src.write_bytes(DUMMY_AUDIO)
+        with mock.patch.object(manager_module.fcntl, 'ioctl', side_effect=OSError), \
+                mock.patch.object(os, 'copy_file_range', return_value=0):
+            _fast_copy(src, dst)
+        self.assertEqual(dst.read_bytes(), DUMMY_AUDIO)
@@ -0,0 +1,70 @@
+import unittest
+from unittest import mock
+
+from audio_file_manager import manager as manager_module
+from audio_file_manager.manager import _PcmRing
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+
+@unittest.skipUnless(NUMPY_AVAILABLE, "numpy not available for ring buffer tests.")
+class TestPcmRing(unittest.TestCase):
+    def setUp(self):
+        # The module only imports numpy with the sounddevice backend, so supply it here.
+        patcher = mock.patch.object(manager_module, 'np', np, create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ring = _PcmRing(8, 2)
+        self.received = []
+
+    def _frames(self, start, count):
+        return np.arange(start * 2, (start + count) * 2, dtype=np.int16).reshape(count, 2)
+
+    def _sink(self, view):
+        # Copy, since the views point into ring memory that later writes reuse.
+        self.received.append(view.copy())
+
+    def test_read_returns_frames_in_order(self):
+        self.ring.write(self._frames(0, 3))
+        self.assertEqual(self.ring.read(self._sink), 3)
+        self.assertEqual(len(self.received), 1)
+        np.testing.assert_array_equal(self.received[0], self._frames(0, 3))
+        self.assertEqual(self.ring.read(self._sink), 0)
+
+    def test_write_and_read_across_the_wrap_point(self):
+        self.ring.write(self._frames(0, 6))
+        self.ring.read(self._sink)
+        self.received.clear()
+
+        self.ring.write(self._frames(6, 5))
+        self.assertEqual(self.ring.read(self._sink), 5)
+        self.assertEqual([len(view) for view in self.received], [2, 3])
+        np.testing.assert_array_equal(np.concatenate(self.received), self._frames(6, 5))
+
+    def test_overflow_drops_the_whole_block(self):
+        self.ring.write(self._frames(0, 6))
+        self.ring.write(self._frames(6, 3))
+        self.assertEqual(self.ring.overflows, 1)
+
+        # Blocks that still fit are kept after a drop, and nothing unread was overwritten.
+        self.ring.write(self._frames(9, 2))
+        self.assertEqual(self.ring.read(self._sink), 8)
+        np.testing.assert_array_equal(np.concatenate(self.received),
+                                      np.concatenate([self._frames(0, 6), self._frames(9, 2)]))
+
+    def test_final_drain_picks_up_frames_written_after_the_last_poll(self):
+        self.ring.write(self._frames(0, 4))
+        self.ring.read(self._sink)
+        self.ring.write(self._frames(4, 3))
+        # The recording thread does one last read after the stream has closed.
+        self.assertEqual(self.ring.read(self._sink), 3)
+        np.testing.assert_array_equal(np.concatenate(self.received), self._frames(0, 7))
+
+    def test_capacity_must_be_a_power_of_two(self):
+        for capacity in (0, 6, 100):
+            with self.assertRaises(ValueError):
+                _PcmRing(capacity, 1)
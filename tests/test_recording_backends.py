@@ -0,0 +1,170 @@
+import unittest
+import tempfile
+import shutil
+import wave
+from threading import Event
+from unittest import mock
+
+from audio_file_manager import AudioFileManager
+from audio_file_manager import manager as manager_module
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+
+class FakeAlsa:
+    """Stands in for the alsaaudio module: PCM.read() replays `reads`, then sets `stop_event`."""
+    PCM_CAPTURE = "capture"
+    PCM_NORMAL = "normal"
+    PCM_FORMAT_S16_LE = "s16_le"
+
+    def __init__(self, reads, stop_event):
+        self.reads = list(reads)
+        self.stop_event = stop_event
+        self.pcm = None
+
+    def PCM(self, *args, **kwargs):
+        self.pcm = FakePcm(self, args, kwargs)
+        return self.pcm
+
+
+class FakePcm:
+    def __init__(self, module, args, kwargs):
+        self.module = module
+        self.args = args
+        self.kwargs = kwargs
+        self.settings = {}
+
+    def setchannels(self, channels):
+        self.settings['channels'] = channels
+
+    def setrate(self, rate):
+        self.settings['rate'] = rate
+
+    def setformat(self, fmt):
+        self.settings['format'] = fmt
+
+    def setperiodsize(self, period_size):
+        self.settings['period_size'] = period_size
+
+    def read(self):
+        result = self.module.reads.pop(0)
+        if not self.module.reads:
+            self.module.stop_event.set()
+        return result
+
+
+class FakeSounddevice:
+    """Stands in for the sounddevice module, keeping the arguments of the last InputStream."""
+
+    class CallbackStop(Exception):
+        pass
+
+    def __init__(self):
+        self.stream_kwargs = None
+        self.callback = None
+
+    def InputStream(self, **kwargs):
+        self.stream_kwargs = kwargs
+        self.callback = kwargs['callback']
+        return mock.MagicMock()
+
+
+class ScriptedStop(Event):
+    """
+    Stop event for the sounddevice drain loop. Each wait() delivers the next block to the callback;
+    the last block arrives together with the stop, so only the final drain after the stream closes sees it.
+    """
+
+    def __init__(self, fake_sd, blocks):
+        super().__init__()
+        self.fake_sd = fake_sd
+        self.blocks = list(blocks)
+
+    def wait(self, timeout=None):
+        block = self.blocks.pop(0)
+        self.fake_sd.callback(block, len(block), None, None)
+        if not self.blocks:
+            self.set()
+        return self.is_set()
+
+
+class TestRecordingBackends(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.manager = AudioFileManager(storage_dir=self.test_dir, metadata_file=f"{self.test_dir}/meta.json")
+
+    def tearDown(self):
+        self.manager.cleanup()
+        shutil.rmtree(self.test_dir)
+
+    def _read_wav(self, path):
+        with wave.open(path, 'rb') as wf:
+            return wf.getnchannels(), wf.getframerate(), wf.getnframes(), wf.readframes(wf.getnframes())
+
+    def test_alsa_recording_streams_periods_into_the_wav_file(self):
+        stop_event = Event()
+        period_a = bytes(range(16))
+        period_b = bytes(range(16, 32))
+        fake = FakeAlsa([(4, period_a), (-32, b''), (4, period_b)], stop_event)
+        with mock.patch.multiple(manager_module, AUDIO_BACKEND="alsaaudio", alsaaudio=fake, create=True):
+            with self.assertLogs('audio_file_manager.manager', level='WARNING') as cm:
+                info = self.manager.record_audio_to_temp('btn1', 'Away Message', stop_event, channels=2,
+                                                         rate=8000, period_size=4, periods=3)
+
+        self.assertEqual(fake.pcm.args, (fake.PCM_CAPTURE, fake.PCM_NORMAL))
+        self.assertEqual(fake.pcm.kwargs, {"periods": 3})
+        self.assertEqual(fake.pcm.settings, {'channels': 2, 'rate': 8000, 'format': fake.PCM_FORMAT_S16_LE,
+                                             'period_size': 4})
+        self.assertIn("overran 1 time(s)", cm.output[0])
+
+        # The overrun read carries no audio, so only the two good periods are written.
+        self.assertEqual(self._read_wav(info['temp_path']), (2, 8000, 8, period_a + period_b))
+        self.assertEqual(info['duration'], 0.001)
+        self.assertTrue(info['temp_path'].endswith('.wav'))
+        self.assertIn('btn1_away_message_', info['temp_path'])
+
+    def test_alsa_defaults_leave_periods_to_alsa(self):
+        stop_event = Event()
+        fake = FakeAlsa([(2, b'\x01\x00\x02\x00')], stop_event)
+        with mock.patch.multiple(manager_module, AUDIO_BACKEND="alsaaudio", alsaaudio=fake, create=True):
+            info = self.manager.record_audio_to_temp('btn2', 'note', stop_event, rate=8000)
+
+        self.assertEqual(fake.pcm.kwargs, {})
+        self.assertEqual(fake.pcm.settings['period_size'], 8000 * manager_module.ALSA_PERIOD_MS // 1000)
+        self.assertEqual(self._read_wav(info['temp_path']), (1, 8000, 2, b'\x01\x00\x02\x00'))
+
+    @unittest.skipUnless(NUMPY_AVAILABLE, "numpy not available for sounddevice recording tests.")
+    def test_sounddevice_recording_drains_the_ring_into_the_wav_file(self):
+        fake_sd = FakeSounddevice()
+        blocks = [np.full((256, 1), i, dtype=np.int16) for i in range(1, 4)]
+        stop_event = ScriptedStop(fake_sd, blocks)
+        with mock.patch.multiple(manager_module, AUDIO_BACKEND="sounddevice", sd=fake_sd, np=np, create=True):
+            info = self.manager.record_audio_to_temp('btn3', 'note', stop_event, rate=16000, period_size=256)
+
+            # Once stopped, the callback asks PortAudio to end the stream instead of writing.
+            with self.assertRaises(fake_sd.CallbackStop):
+                fake_sd.callback(blocks[0], 256, None, None)
+
+        self.assertEqual(fake_sd.stream_kwargs['blocksize'], 256)
+        self.assertEqual(fake_sd.stream_kwargs['samplerate'], 16000)
+        self.assertEqual(fake_sd.stream_kwargs['channels'], 1)
+        self.assertEqual(fake_sd.stream_kwargs['dtype'], 'int16')
+
+        channels, rate, nframes, payload = self._read_wav(info['temp_path'])
+        self.assertEqual((channels, rate, nframes), (1, 16000, 768))
+        self.assertEqual(payload, np.concatenate(blocks).tobytes())
+        self.assertEqual(info['duration'], 0.048)
+
+    @unittest.skipUnless(NUMPY_AVAILABLE, "numpy not available for sounddevice recording tests.")
+    def test_sounddevice_rejects_blocks_larger_than_the_ring(self):
+        fake_sd = FakeSounddevice()
+        with mock.patch.multiple(manager_module, AUDIO_BACKEND="sounddevice", sd=fake_sd, np=np, create=True):
+            with self.assertRaises(ValueError):
+                self.manager.record_audio_to_temp('btn4', 'note', Event(),
+                                                  period_size=manager_module.SD_RING_FRAMES + 1)
+        self.assertIsNone(fake_sd.stream_kwargs)
+        self.assertEqual(list(self.manager.temp_dir.iterdir()), [])